@@ -0,0 +1,169 @@
+# ================================================
+# adaptive_resolution.py
+# ================================================
+import numpy as np
+
+# Candidate inference sizes (multiples of the 32px YOLO stride); the model's
+# reference size is always added, and 800 lets small, distant animals
+# escalate past it
+SIZES = (320, 480, 640, 800)
+
+# Reference size for checkpoints that do not record their training imgsz
+FIXED_SIZE = 640
+
+# Escalate when the best detection is below this confidence...
+LOW_CONFIDENCE = 0.5
+# ...or the smallest box side is below this fraction of the frame
+SMALL_BOX = 0.06
+# Step down when every box side is at least this fraction of the frame
+LARGE_BOX = 0.25
+
+# Compare against the fixed size on every Nth prediction run at another size
+AUDIT_EVERY = 30
+MATCH_IOU = 0.5
+
+
+def reference_size(model):
+    """
+    The size model.predict uses when imgsz is not given: ultralytics keeps the
+    checkpoint's training imgsz in model.overrides (512 for this model).
+    """
+    imgsz = getattr(model, "overrides", {}).get("imgsz") or FIXED_SIZE
+    return int(imgsz[0] if isinstance(imgsz, (list, tuple)) else imgsz)
+
+
+def warmup(model, sizes=SIZES):
+    """Run one dummy frame per size so no request pays the first-call cost."""
+    sizes = sorted(set(sizes) | {reference_size(model)})
+    blank = np.zeros((max(sizes), max(sizes), 3), dtype=np.uint8)
+    for size in sizes:
+        model.predict(blank, imgsz=size, verbose=False)
+
+
+def _boxes(results):
+    if not results or len(results[0].boxes) == 0:
+        return np.empty((0, 4)), np.empty(0, dtype=int), np.empty(0)
+    boxes = results[0].boxes
+    return boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy().astype(int), boxes.conf.cpu().numpy()
+
+
+def _iou(a, b):
+    """Pairwise IoU between two sets of xyxy boxes."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def count_matches(results, reference):
+    """Greedy same-class matches at IoU >= MATCH_IOU; returns (matched, reference_count)."""
+    boxes, classes, _ = _boxes(results)
+    ref_boxes, ref_classes, _ = _boxes(reference)
+    if len(boxes) == 0 or len(ref_boxes) == 0:
+        return 0, len(ref_boxes)
+    ious = _iou(ref_boxes, boxes)
+    ious[ref_classes[:, None] != classes[None, :]] = 0
+    matched = 0
+    for r in range(len(ref_boxes)):
+        p = int(np.argmax(ious[r]))
+        if ious[r, p] >= MATCH_IOU:
+            matched += 1
+            ious[:, p] = 0
+    return matched, len(ref_boxes)
+
+
+class ResolutionController:
+    """
+    Picks the inference size from the detections it has seen.
+
+    In "image" mode a frame starts at the smallest size and is re-run at a
+    larger one while the result looks unreliable (low confidence or tiny
+    boxes; an empty result gets one more look at the reference size). In
+    "video" mode each frame runs once at the current size and the result only
+    moves the size used for the next frame: empty frames step it down, low
+    confidence or tiny boxes step it up.
+
+    fixed_size is the size the non-adaptive path runs at (reference_size()).
+    """
+
+    def __init__(self, mode="video", sizes=SIZES, fixed_size=FIXED_SIZE, audit_every=AUDIT_EVERY):
+        self.mode = mode
+        self.sizes = tuple(sorted(set(sizes) | {fixed_size}))
+        self.fixed_level = self.sizes.index(fixed_size)
+        self.fixed_size = fixed_size
+        self.audit_every = audit_every
+        self.level = 0 if mode == "image" else self.fixed_level
+        self.predictions = 0
+        self.passes = 0
+        self.size_total = 0
+        self.off_fixed = 0
+        self.audits = 0
+        self.matched = 0
+        self.reference = 0
+
+    def _next_level(self, results, frame_shape):
+        boxes, _, confs = _boxes(results)
+        if len(boxes) == 0:
+            if self.mode == "image":
+                return max(self.level, self.fixed_level)
+            # Most camera-trap frames are empty; those are the ones to run cheaply
+            return max(self.level - 1, 0)
+        h, w = frame_shape[:2]
+        sides = np.minimum((boxes[:, 2] - boxes[:, 0]) / w, (boxes[:, 3] - boxes[:, 1]) / h)
+        if confs.max() < LOW_CONFIDENCE or sides.min() < SMALL_BOX:
+            return min(self.level + 1, len(self.sizes) - 1)
+        if sides.min() >= LARGE_BOX:
+            return max(self.level - 1, 0)
+        return self.level
+
+    def predict(self, frame, predict_fn):
+        """predict_fn(frame, imgsz) -> ultralytics results."""
+        if self.mode == "image":
+            self.level = 0
+        while True:
+            size = self.sizes[self.level]
+            results = predict_fn(frame, size)
+            self.passes += 1
+            next_level = self._next_level(results, frame.shape)
+            if self.mode == "video" or next_level <= self.level:
+                break
+            self.level = next_level
+
+        self.predictions += 1
+        self.size_total += size
+        if self.mode == "video":
+            self.level = next_level
+
+        # Predictions already at the fixed size would only agree with themselves
+        if size != self.fixed_size:
+            self.off_fixed += 1
+            if self.audit_every and (self.off_fixed - 1) % self.audit_every == 0:
+                self._audit(frame, predict_fn, results)
+        return results
+
+    def _audit(self, frame, predict_fn, results):
+        reference = predict_fn(frame, self.fixed_size)
+        matched, total = count_matches(results, reference)
+        self.audits += 1
+        self.matched += matched
+        self.reference += total
+
+    @property
+    def mean_size(self) -> float:
+        return self.size_total / self.predictions if self.predictions else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "predictions": self.predictions,
+            "passes": self.passes,
+            "mean_size": round(self.mean_size, 1),
+            "fixed_size": self.fixed_size,
+            "off_fixed": self.off_fixed,
+            "audits": self.audits,
+            # Share of fixed-size detections also found at a non-fixed size
+            "agreement": round(self.matched / self.reference, 4) if self.reference else None,
+        }
@@ -1,17 +1,54 @@
+import runtime_config
+# Sizes the torch/OpenMP pools; Streamlit has already imported numpy, so its BLAS
+# pool only follows OMP_NUM_THREADS etc. when they are set in the launch environment
+runtime_config.configure_environment()
+
 import streamlit as st
-from ultralytics import YOLO
 import tempfile
 import cv2
 import os
+import time
+import hashlib
+import uuid
 import numpy as np
 import skfuzzy as fuzz
 import json
+from frame_dedup import DetectionCache, DEFAULT_THRESHOLD
+from detection_store import DetectionStore
+from adaptive_resolution import ResolutionController, reference_size
+from cascade import CascadeDetector, FIRST_PASS_SIZE, FIRST_PASS_CONF
+from video_jobs import (JobManager, QueueFullError, MAX_WORKERS, archive_settings, archive_source_id,
+                        find_archived, record_detections, filter_confidence, draw_detections)
 
 # ======================================================
-# Load trained YOLOv8 model
+# Load trained YOLOv8 model (pool of pinned replicas, see runtime_config.json)
 # ======================================================
 MODEL_PATH = "animal_training_fast_final/yolov8n_fast_clean_mapped/weights/best.pt"
-model = YOLO(MODEL_PATH)
+
+@st.cache_resource
+def load_model():
+    # Shared by all sessions; each replica keeps every adaptive size warm
+    return runtime_config.ModelPool(MODEL_PATH)
+
+model = load_model()
+
+# ======================================================
+# Detection Archive (shared across sessions)
+# ======================================================
+@st.cache_resource
+def get_detection_store():
+    return DetectionStore(names=model.names)
+
+store = get_detection_store()
+
+# ======================================================
+# Background Video Jobs (worker pool shared across sessions)
+# ======================================================
+@st.cache_resource
+def get_job_manager():
+    return JobManager(model, store, max_workers=max(MAX_WORKERS, model.replicas))
+
+job_manager = get_job_manager()
 
 # ======================================================
 # Load Animal Knowledge Base (JSON)
@@ -101,6 +138,30 @@ st.write("Upload an **image** or **video**, and the system will detect animals,
 st.sidebar.header("⚙️ Detection Settings")
 conf_threshold = st.sidebar.slider("Confidence Threshold", 0.1, 1.0, 0.35, 0.05)
 iou_threshold = st.sidebar.slider("IoU Threshold (Overlap)", 0.1, 1.0, 0.45, 0.05)
+dedup_enabled = st.sidebar.checkbox("Skip Near-Duplicate Frames", value=True)
+dedup_threshold = st.sidebar.slider("Duplicate Hash Distance", 0, 16, DEFAULT_THRESHOLD, 1)
+adaptive_enabled = st.sidebar.checkbox("Adaptive Input Resolution", value=False)
+cascade_enabled = st.sidebar.checkbox("Cascade Mode (Early Danger Alerts)", value=False)
+
+def current_settings():
+    return {
+        "conf": conf_threshold,
+        "iou": iou_threshold,
+        "dedup_enabled": dedup_enabled,
+        "dedup_threshold": dedup_threshold,
+        "adaptive": adaptive_enabled,
+        "cascade": cascade_enabled,
+    }
+
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
+# Image cache lives in the session so burst uploads can hit it across reruns
+if "image_cache" not in st.session_state:
+    st.session_state.image_cache = DetectionCache()
+st.session_state.image_cache.threshold = dedup_threshold
+if "image_resolution" not in st.session_state:
+    st.session_state.image_resolution = ResolutionController(mode="image", fixed_size=reference_size(model))
 
 uploaded_file = st.file_uploader("📁 Upload Image or Video", type=["jpg", "jpeg", "png", "mp4", "mov", "avi"])
 
@@ -129,21 +190,111 @@ def display_animal_card(animal_info):
     st.info(f"**Fun Fact:** {animal_info['fact']}")
     st.markdown("---")
 
+# ======================================================
+# High-danger alerts (cascade mode)
+# ======================================================
+def display_alert(alert):
+    st.error(
+        f"🚨 **{alert['species']}** spotted (danger {alert['danger']:.0f}%, "
+        f"{alert['stage']}, +{alert['latency']:.2f}s) – Maintain Distance!"
+    )
+
+def display_cascade_stats(stats):
+    if not stats or stats["frames"] == 0:
+        return
+    first_alert = f"{stats['time_to_first_alert']:.2f}s" if stats["time_to_first_alert"] is not None else "no alert"
+    st.caption(
+        f"🪜 Cascade: {stats['first_passes']} first passes at {FIRST_PASS_SIZE}px, "
+        f"{stats['full_passes']}/{stats['frames']} full passes, {stats.get('reused', 0)} frames reused, "
+        f"time to first alert: {first_alert}"
+    )
+
+# ======================================================
+# Perceptual-hash dedup in front of the detector
+# ======================================================
+def full_pass(frame):
+    """Full detector run, at an adaptive size if enabled."""
+    if adaptive_enabled:
+        controller = st.session_state.image_resolution
+        sized_predict = lambda f, size: model.predict(f, imgsz=size, conf=conf_threshold, iou=iou_threshold, verbose=False)
+        return controller.predict(frame, sized_predict)
+    return model.predict(frame, conf=conf_threshold, iou=iou_threshold, verbose=False)
+
+def predict_frame(frame, cache, cascade=None):
+    """Run the detector on a frame, reusing cached results for near-duplicates."""
+    predict_fn = cascade.predict if cascade is not None else full_pass
+    if not dedup_enabled:
+        return predict_fn(frame)
+    # A 320px first pass or an adaptive-size run must not stand in for a plain full pass
+    params = (conf_threshold, iou_threshold, adaptive_enabled, cascade is not None)
+    results, _ = cache.predict(frame, predict_fn, params=params)
+    return results
+
+def display_dedup_stats(stats):
+    if not stats or stats["lookups"] == 0:
+        return
+    st.caption(
+        f"♻️ Dedup cache: {stats['hits']}/{stats['lookups']} hits "
+        f"({stats['hit_rate']:.0%}), {stats['detections_saved']} detections reused"
+    )
+
+def display_resolution_stats(stats):
+    if not stats or stats["predictions"] == 0:
+        return
+    agreement = f"{stats['agreement']:.0%}" if stats["agreement"] is not None else "n/a"
+    st.caption(
+        f"📐 Adaptive resolution: avg {stats['mean_size']:.0f}px over {stats['predictions']} predictions "
+        f"({stats['passes']} passes), {agreement} agreement with {stats['fixed_size']}px "
+        f"on {stats['audits']} audited of {stats['off_fixed']} run at other sizes"
+    )
+
 # ======================================================
 # Function: process and display image
 # ======================================================
-def process_image(image_path):
+def process_image(file_bytes, content_id):
     st.subheader("🔍 Detection Result (Image)")
-    results = model.predict(source=image_path, conf=conf_threshold, iou=iou_threshold, save=False)
-    annotated_frame = results[0].plot()
+    cache = st.session_state.image_cache
+    frame = cv2.imdecode(np.frombuffer(file_bytes, np.uint8), cv2.IMREAD_COLOR)
 
-    detected_animals = []
-    if results and len(results[0].boxes) > 0:
-        for c in results[0].boxes.cls:
-            label = model.names[int(c)]
-            detected_animals.append(label)
+    cascade = None
+    if cascade_enabled:
+        # Alerts render as soon as the first pass sees a high-danger animal
+        first_pass = lambda f: model.predict(f, imgsz=FIRST_PASS_SIZE, conf=min(FIRST_PASS_CONF, conf_threshold),
+                                             iou=iou_threshold, verbose=False)
+        cascade = CascadeDetector(first_pass, full_pass, model.names, on_alert=display_alert, stride=1)
+
+    settings = current_settings()
+    replay_id = find_archived(store, content_id, settings)
+    if replay_id is not None:
+        rows = filter_confidence(store.get_source(replay_id), conf_threshold)
+        annotated_frame = draw_detections(frame, rows, model.names)
+        detected_animals = [model.names[int(c)] for c in rows["class_id"]]
+        st.caption("📦 Loaded from detection archive – no inference needed.")
+        if cascade is not None:
+            cascade.check_alerts(rows["class_id"].tolist(), rows["confidence"].tolist(), 0)
+    else:
+        results = predict_frame(frame, cache, cascade)
+        if cascade is not None:
+            # Also covers dedup cache hits, where the cascade itself never ran
+            cascade.observe(results, 0)
+        # A cache hit may come from an earlier upload, so draw on this image
+        annotated_frame = results[0].plot(img=frame)
+
+        detected_animals = []
+        if results and len(results[0].boxes) > 0:
+            for c in results[0].boxes.cls:
+                label = model.names[int(c)]
+                detected_animals.append(label)
+
+        meta = {"type": "image", "content": content_id, **archive_settings(settings)}
+        writer = store.writer(archive_source_id(content_id, settings), meta=meta)
+        record_detections(writer, model.names, 0, time.time(), results)
+        writer.commit()
 
     st.image(annotated_frame, caption="Detected Animals", use_container_width=True)
+    display_dedup_stats(cache.stats() if dedup_enabled else None)
+    display_resolution_stats(st.session_state.image_resolution.stats() if adaptive_enabled else None)
+    display_cascade_stats(cascade.stats() if cascade is not None else None)
 
     if detected_animals:
         st.subheader("🧩 Knowledge Inference (Fuzzy + CSP)")
@@ -154,57 +305,84 @@ def process_image(image_path):
         st.warning("No animals detected in the image.")
 
 # ======================================================
-# Function: process and display video
+# Function: process and display video (background job)
 # ======================================================
-def process_video(video_path):
-    st.subheader("🎬 Processing Video... Please wait")
-
-    temp_out = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
-    output_path = temp_out.name
+def process_video(file_bytes, file_ext, content_id):
+    """Queue the clip once per session and settings; reruns just poll its job."""
+    jobs = st.session_state.setdefault("video_jobs", {})
+    settings = current_settings()
+    key = archive_source_id(content_id, settings)
+    if key in jobs and job_manager.status(jobs[key]) is None:
+        del jobs[key]  # pruned by the job manager's retention policy
+    if key not in jobs:
+        # Written only on submit; the job manager deletes it when the job ends
+        temp_input = tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_ext}")
+        temp_input.write(file_bytes)
+        temp_input.close()
+        video_path = temp_input.name
+        try:
+            jobs[key] = job_manager.submit(video_path, content_id, settings, owner=st.session_state.session_id)
+        except QueueFullError as e:
+            st.error(f"🚦 {e}")
+            return
+    st.query_params["job"] = jobs[key]
+    display_video_job(jobs[key])
 
-    cap = cv2.VideoCapture(video_path)
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    fps = int(cap.get(cv2.CAP_PROP_FPS))
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+def forget_job(job_id):
+    """Drop an ended job from the session so the same upload is submitted again."""
+    jobs = st.session_state.get("video_jobs", {})
+    for key, jid in list(jobs.items()):
+        if jid == job_id:
+            del jobs[key]
 
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    progress = st.progress(0)
-    detected_species = set()
+def display_video_job(job_id):
+    job = job_manager.status(job_id)
+    if job is None:
+        st.error("Unknown video job – it may have been cleaned up.")
+        return
 
-    frame_idx = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    if job["state"] == "queued":
+        st.subheader("🕒 Video queued for processing")
+        st.write(f"Position in queue: {job_manager.queue_position(job_id)}")
+    elif job["state"] == "running":
+        st.subheader("🎬 Processing Video... Please wait")
+        st.progress(job["progress"])
 
-        results = model.predict(frame, conf=conf_threshold, iou=iou_threshold, verbose=False)
-        annotated_frame = results[0].plot()
+    # Cascade alerts are persisted as they happen, so they show while the job runs
+    for alert in job.get("alerts", []):
+        display_alert(alert)
 
-        if results and len(results[0].boxes) > 0:
-            for c in results[0].boxes.cls:
-                label = model.names[int(c)]
-                detected_species.add(label)
-
-        out.write(annotated_frame)
-        frame_idx += 1
-        progress.progress(min(frame_idx / frame_count, 1.0))
+    if job["state"] in ("queued", "running"):
+        if st.button("✖️ Cancel Processing"):
+            job_manager.cancel(job_id)
+        time.sleep(1)
+        st.rerun()
+    elif job["state"] in ("cancelled", "failed"):
+        if job["state"] == "cancelled":
+            st.warning("Video processing was cancelled.")
+        else:
+            st.error(f"Video processing failed: {job['error']}")
+        st.button("🔁 Retry", on_click=forget_job, args=(job_id,))
+        return
 
-    cap.release()
-    out.release()
+    result = job["result"]
     st.success("✅ Video processing complete!")
-    st.video(output_path)
+    st.video(job["output_path"])
+    if result["archived"]:
+        st.caption("📦 Loaded from detection archive – replaying stored detections.")
+    display_dedup_stats(result["dedup"])
+    display_resolution_stats(result.get("resolution"))
+    display_cascade_stats(result.get("cascade"))
 
-    if detected_species:
+    if result["species"]:
         st.subheader("🧩 Knowledge Inference (Fuzzy + CSP)")
-        for animal in detected_species:
+        for animal in result["species"]:
             info = infer_animal_details(animal)
             display_animal_card(info)
     else:
         st.warning("No animals detected in the video.")
 
-    with open(output_path, "rb") as f:
+    with open(job["output_path"], "rb") as f:
         st.download_button("⬇️ Download Processed Video", data=f, file_name="detected_animals.mp4")
 
 # ======================================================
@@ -212,13 +390,15 @@ def process_video(video_path):
 # ======================================================
 if uploaded_file:
     file_ext = uploaded_file.name.split(".")[-1].lower()
-    temp_input = tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_ext}")
-    temp_input.write(uploaded_file.read())
-    temp_input.close()
+    file_bytes = uploaded_file.read()
+    content_id = hashlib.sha1(file_bytes).hexdigest()
 
     if file_ext in ["jpg", "jpeg", "png"]:
-        process_image(temp_input.name)
+        process_image(file_bytes, content_id)
     elif file_ext in ["mp4", "mov", "avi"]:
-        process_video(temp_input.name)
+        process_video(file_bytes, file_ext, content_id)
     else:
         st.error("Unsupported file type! Please upload JPG, PNG, or MP4 video.")
+elif "job" in st.query_params:
+    # Page reloaded: pick the video job back up from the URL
+    display_video_job(st.query_params["job"])
@@ -0,0 +1,154 @@
+# ================================================
+# cascade.py
+# ================================================
+import time
+
+from fuzzy_danger_level import compute_danger_level
+
+# Cheap first pass: small input, permissive confidence
+FIRST_PASS_SIZE = 320
+FIRST_PASS_CONF = 0.2
+
+# Video: run the first pass on every Nth frame only
+FRAME_STRIDE = 3
+
+# Same cut-off as the "High Risk Animal" card in the app
+HIGH_DANGER = 70
+
+
+class CascadeDetector:
+    """
+    Two-stage detector: a low-resolution first pass looks for candidates and
+    the full detector only runs where it finds some.
+
+    Priority follows the fuzzy danger level of the candidates. With a
+    high-danger candidate the full detector runs on every frame until the next
+    first pass clears it; with only low/medium-danger candidates it runs on the
+    first-pass frames and its result is reused in between; with no candidates
+    only the first pass runs. High-danger hits call on_alert immediately, once
+    per species and stage ("first-pass", then "confirmed").
+
+    Per video frame the caller asks needs_inference(frame_idx); if False it
+    takes reuse() (not a detection on this frame, so it must not be cached or
+    archived), otherwise predict(). Results obtained elsewhere, such as a
+    dedup cache hit or the archive, go through observe() / check_alerts() so
+    priority and alerts still follow them.
+    """
+
+    def __init__(self, first_pass_fn, full_pass_fn, names, on_alert=None, stride=FRAME_STRIDE):
+        self.first_pass_fn = first_pass_fn
+        self.full_pass_fn = full_pass_fn
+        self.names = names
+        self.on_alert = on_alert
+        self.stride = stride
+        self.priority = None
+        self._last = None
+        self._alerted = set()
+        self.start_time = time.perf_counter()
+        self.frames = 0
+        self.first_passes = 0
+        self.full_passes = 0
+        self.reused = 0
+        self.alerts = []
+
+    def _seen(self, frame_idx):
+        self.frames = max(self.frames, frame_idx + 1)
+
+    @staticmethod
+    def _detections(results):
+        if not results or len(results[0].boxes) == 0:
+            return [], []
+        boxes = results[0].boxes
+        return boxes.cls.tolist(), boxes.conf.tolist()
+
+    def _high_danger(self, class_ids, confidences):
+        hits = []
+        for c, conf in zip(class_ids, confidences):
+            name = self.names[int(c)]
+            danger = compute_danger_level(name)
+            if danger >= HIGH_DANGER:
+                hits.append((name, danger, float(conf)))
+        return hits
+
+    def check_alerts(self, class_ids, confidences, frame_idx, stage="confirmed"):
+        """Alert on high-danger detections, wherever they came from."""
+        self._seen(frame_idx)
+        for name, danger, conf in self._high_danger(class_ids, confidences):
+            if (name, stage) in self._alerted:
+                continue
+            self._alerted.add((name, stage))
+            alert = {
+                "species": name,
+                "danger": danger,
+                "confidence": round(conf, 3),
+                "frame": frame_idx,
+                "stage": stage,
+                "latency": round(time.perf_counter() - self.start_time, 3),
+            }
+            self.alerts.append(alert)
+            if self.on_alert is not None:
+                self.on_alert(alert)
+
+    def _set_priority(self, class_ids, confidences):
+        if not class_ids:
+            self.priority = None
+        elif self._high_danger(class_ids, confidences):
+            self.priority = "high"
+        else:
+            self.priority = "low"
+
+    def _full_pass(self, frame, frame_idx):
+        results = self.full_pass_fn(frame)
+        self.full_passes += 1
+        self.check_alerts(*self._detections(results), frame_idx, "confirmed")
+        self._last = results
+        return results
+
+    def needs_inference(self, frame_idx) -> bool:
+        """False between first passes when the last result can stand in."""
+        self._seen(frame_idx)
+        if self._last is None:
+            return True
+        return frame_idx % self.stride == 0 or self.priority == "high"
+
+    def reuse(self):
+        self.reused += 1
+        return self._last
+
+    def observe(self, results, frame_idx):
+        """Adopt results computed outside the cascade (e.g. a dedup cache hit)."""
+        self._seen(frame_idx)
+        class_ids, confidences = self._detections(results)
+        self._set_priority(class_ids, confidences)
+        self.check_alerts(class_ids, confidences, frame_idx, "confirmed")
+        self._last = results
+
+    def predict(self, frame, frame_idx=0):
+        self._seen(frame_idx)
+        if frame_idx % self.stride != 0 and self._last is not None:
+            return self._full_pass(frame, frame_idx)
+
+        candidates = self.first_pass_fn(frame)
+        self.first_passes += 1
+        class_ids, confidences = self._detections(candidates)
+        self._set_priority(class_ids, confidences)
+        if not class_ids:
+            self._last = candidates
+            return candidates
+
+        self.check_alerts(class_ids, confidences, frame_idx, "first-pass")
+        return self._full_pass(frame, frame_idx)
+
+    @property
+    def time_to_first_alert(self):
+        return self.alerts[0]["latency"] if self.alerts else None
+
+    def stats(self) -> dict:
+        return {
+            "frames": self.frames,
+            "first_passes": self.first_passes,
+            "full_passes": self.full_passes,
+            "reused": self.reused,
+            "alerts": len(self.alerts),
+            "time_to_first_alert": self.time_to_first_alert,
+        }
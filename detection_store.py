@@ -0,0 +1,393 @@
+# ================================================
+# detection_store.py
+# ================================================
+import os
+import json
+import time
+import threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Default archive location (relative to the app working directory)
+ARCHIVE_DIR = "detection_archive"
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "archive.lock"
+
+# Merge all chunks once there are more than this many (one per committed source)
+AUTO_COMPACT_CHUNKS = 64
+
+# Column layout of every chunk: name -> (dtype, trailing shape)
+COLUMNS = {
+    "source": (np.int32, ()),        # key into the manifest's source table
+    "frame": (np.int32, ()),         # frame index (0 for still images)
+    "timestamp": (np.float64, ()),   # wall-clock seconds since epoch
+    "class_id": (np.int16, ()),
+    "confidence": (np.float32, ()),
+    "box": (np.float32, (4,)),       # x1, y1, x2, y2 in pixels
+    "danger": (np.float32, ()),
+}
+
+
+def _empty_columns(n=0):
+    return {name: np.empty((n,) + shape, dtype=dtype) for name, (dtype, shape) in COLUMNS.items()}
+
+
+def _concat(parts):
+    if not parts:
+        return _empty_columns()
+    return {name: np.concatenate([p[name] for p in parts]) for name in COLUMNS}
+
+
+def _take(columns, rows):
+    return {name: col[rows] for name, col in columns.items()}
+
+
+def _group_index(values):
+    """Map each distinct value to the (sorted) row ids holding it."""
+    order = np.argsort(values, kind="stable")
+    keys, starts = np.unique(values[order], return_index=True)
+    return {int(k): rows for k, rows in zip(keys, np.split(order, starts[1:]))}
+
+
+class SourceWriter:
+    """Buffers the detections of one source until it is committed to the store."""
+
+    def __init__(self, store, source_id, meta=None):
+        self.store = store
+        self.source_id = source_id
+        self.meta = meta or {}
+        self._parts = []
+
+    def add(self, frame, timestamp, class_ids, confidences, boxes, dangers):
+        n = len(class_ids)
+        if n == 0:
+            return
+        part = _empty_columns(n)
+        part["frame"][:] = frame
+        part["timestamp"][:] = timestamp
+        part["class_id"][:] = class_ids
+        part["confidence"][:] = confidences
+        part["box"][:] = np.asarray(boxes, dtype=np.float32).reshape(n, 4)
+        part["danger"][:] = dangers
+        self._parts.append(part)
+
+    def commit(self):
+        return self.store._commit_source(self.source_id, _concat(self._parts), self.meta)
+
+
+class _ArchiveLock:
+    """Exclusive lock on the archive, held across processes (app, CLI) while writing."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after ~10s; keep waiting
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        else:
+            self._file.seek(0)
+            msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        self._file.close()
+
+
+class _Segment:
+    """One chunk held in memory with its own per-species and per-source indexes."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.species_index = _group_index(columns["class_id"])
+        self.source_index = _group_index(columns["source"])
+
+    def __len__(self):
+        return len(self.columns["class_id"])
+
+
+class DetectionStore:
+    """
+    Append-only columnar archive of detections.
+
+    Each committed source is written as one NumPy chunk (.npz) and recorded in
+    a JSON manifest; a source appears in the manifest only after its chunk is
+    on disk, so a crashed run is simply re-processed. Every chunk is loaded
+    once and indexed on its own, so a commit only indexes its new rows; past
+    AUTO_COMPACT_CHUNKS chunks they are merged into one. Writes re-read the
+    manifest under an inter-process lock, so the CLI can compact or query
+    while the app is running.
+    """
+
+    def __init__(self, root=ARCHIVE_DIR, names=None):
+        self.root = root
+        self._lock = threading.RLock()
+        os.makedirs(root, exist_ok=True)
+        self._names = {str(k): v for k, v in dict(names).items()} if names else None
+        self._stamp = None
+        self._manifest = None
+        self._segments = {}  # chunk name -> _Segment
+        self._refresh(force=True)
+
+    # ---------------- manifest ----------------
+    def _manifest_path(self):
+        return os.path.join(self.root, MANIFEST_NAME)
+
+    def _file_lock(self):
+        return _ArchiveLock(os.path.join(self.root, LOCK_NAME))
+
+    def _manifest_stamp(self):
+        try:
+            st = os.stat(self._manifest_path())
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _refresh(self, force=False):
+        """Re-read the manifest if another process (or instance) has replaced it."""
+        stamp = self._manifest_stamp()
+        if not force and stamp == self._stamp:
+            return
+        manifest = {"chunks": [], "sources": {}, "names": {}, "next_chunk": 0}
+        if stamp is not None:
+            with open(self._manifest_path(), "r") as f:
+                manifest = json.load(f)
+        if self._names:
+            manifest["names"] = self._names
+        self._manifest, self._stamp = manifest, stamp
+        # Drop chunks that were compacted away
+        self._segments = {c: seg for c, seg in self._segments.items() if c in manifest["chunks"]}
+
+    def _write_manifest(self):
+        tmp = self._manifest_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp, self._manifest_path())
+        self._stamp = self._manifest_stamp()
+
+    def _write_chunk(self, columns):
+        name = f"chunk_{self._manifest['next_chunk']:06d}.npz"
+        self._manifest["next_chunk"] += 1
+        tmp = os.path.join(self.root, name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **columns)
+        os.replace(tmp, os.path.join(self.root, name))
+        return name
+
+    def _load_chunk(self, name):
+        with np.load(os.path.join(self.root, name)) as data:
+            return {col: data[col] for col in COLUMNS}
+
+    # ---------------- writes ----------------
+    def has_source(self, source_id) -> bool:
+        with self._lock:
+            self._refresh()
+            return source_id in self._manifest["sources"]
+
+    def sources(self):
+        """(source_id, meta) of every committed source."""
+        with self._lock:
+            self._refresh()
+            return [(sid, entry["meta"]) for sid, entry in self._manifest["sources"].items()]
+
+    def writer(self, source_id, meta=None) -> SourceWriter:
+        return SourceWriter(self, source_id, meta)
+
+    def _commit_source(self, source_id, columns, meta):
+        with self._lock, self._file_lock():
+            self._refresh(force=True)
+            if source_id in self._manifest["sources"]:
+                return self._manifest["sources"][source_id]["key"]
+            key = len(self._manifest["sources"])
+            columns["source"][:] = key
+            if len(columns["class_id"]):
+                name = self._write_chunk(columns)
+                self._manifest["chunks"].append(name)
+                self._segments[name] = _Segment(columns)
+            self._manifest["sources"][source_id] = {
+                "key": key,
+                "rows": int(len(columns["class_id"])),
+                "ingested_at": time.time(),
+                "meta": meta,
+            }
+            self._write_manifest()
+            if len(self._manifest["chunks"]) > AUTO_COMPACT_CHUNKS:
+                self._compact()
+            return key
+
+    def compact(self):
+        """Merge all chunks into one, ordered by source and frame."""
+        with self._lock, self._file_lock():
+            self._refresh(force=True)
+            self._compact()
+
+    def _compact(self):
+        # Caller holds both locks and has just refreshed the manifest
+        old_chunks = list(self._manifest["chunks"])
+        if len(old_chunks) <= 1:
+            return
+        columns = _concat([self._segment(c).columns for c in old_chunks])
+        columns = _take(columns, np.lexsort((columns["frame"], columns["source"])))
+        name = self._write_chunk(columns)
+        self._manifest["chunks"] = [name]
+        self._write_manifest()
+        for old in old_chunks:
+            os.remove(os.path.join(self.root, old))
+        self._segments = {name: _Segment(columns)}
+
+    # ---------------- reads ----------------
+    def _segment(self, name):
+        if name not in self._segments:
+            self._segments[name] = _Segment(self._load_chunk(name))
+        return self._segments[name]
+
+    def _ensure_loaded(self):
+        """Snapshot (manifest, segments); segments are never modified once built."""
+        with self._lock:
+            self._refresh()
+            missing = [c for c in self._manifest["chunks"] if c not in self._segments]
+            if missing:
+                # Hold off concurrent compaction while reading its input chunks
+                with self._file_lock():
+                    self._refresh(force=True)
+                    for c in self._manifest["chunks"]:
+                        self._segment(c)
+            return self._manifest, [self._segments[c] for c in self._manifest["chunks"]]
+
+    def class_id(self, species):
+        """Accept a class id or a species name."""
+        if isinstance(species, (int, np.integer)):
+            return int(species)
+        name = species.strip().title()
+        with self._lock:
+            names = self._manifest["names"]
+        for k, v in names.items():
+            if v.title() == name:
+                return int(k)
+        raise KeyError(f"Unknown species: {species}")
+
+    def source_ids(self, keys):
+        with self._lock:
+            by_key = {s["key"]: sid for sid, s in self._manifest["sources"].items()}
+        return [by_key[int(k)] for k in keys]
+
+    def get_source(self, source_id):
+        """All stored detections of one source, in frame order."""
+        manifest, segments = self._ensure_loaded()
+        key = manifest["sources"][source_id]["key"]
+        empty = np.empty(0, dtype=np.int64)
+        columns = _concat([_take(seg.columns, seg.source_index.get(key, empty)) for seg in segments])
+        return _take(columns, np.argsort(columns["frame"], kind="stable"))
+
+    def query(self, species=None, sources=None, since=None, until=None, min_danger=None, min_confidence=None):
+        """
+        Filter detections. `species` and `sources` are lists; each chunk's
+        per-species and per-source indexes narrow the candidate rows before
+        the scalar filters run.
+        """
+        manifest, segments = self._ensure_loaded()
+        ids = [self.class_id(s) for s in species] if species is not None else None
+        keys = None
+        if sources is not None:
+            keys = [manifest["sources"][s]["key"] for s in sources if s in manifest["sources"]]
+
+        empty = np.empty(0, dtype=np.int64)
+        parts = []
+        for seg in segments:
+            columns = seg.columns
+            rows = None
+            if ids is not None:
+                rows = np.concatenate([seg.species_index.get(i, empty) for i in ids] + [empty])
+            if keys is not None:
+                src_rows = np.concatenate([seg.source_index.get(k, empty) for k in keys] + [empty])
+                rows = src_rows if rows is None else np.intersect1d(rows, src_rows)
+            if rows is None:
+                rows = np.arange(len(seg))
+            rows = np.sort(rows)
+
+            mask = np.ones(len(rows), dtype=bool)
+            if since is not None:
+                mask &= columns["timestamp"][rows] >= since
+            if until is not None:
+                mask &= columns["timestamp"][rows] < until
+            if min_danger is not None:
+                mask &= columns["danger"][rows] >= min_danger
+            if min_confidence is not None:
+                mask &= columns["confidence"][rows] >= min_confidence
+            parts.append(_take(columns, rows[mask]))
+        return _concat(parts)
+
+    def frames_with(self, species):
+        """(source_id, frame) pairs in which every given species was detected together."""
+        _, segments = self._ensure_loaded()
+        empty = np.empty(0, dtype=np.int64)
+        common = None
+        for s in species:
+            cid = self.class_id(s)
+            keys = []
+            for seg in segments:
+                rows = seg.species_index.get(cid, empty)
+                keys.append((seg.columns["source"][rows].astype(np.int64) << 32)
+                            | seg.columns["frame"][rows].astype(np.int64))
+            keys = np.unique(np.concatenate(keys + [empty]))
+            common = keys if common is None else np.intersect1d(common, keys, assume_unique=True)
+        if common is None or len(common) == 0:
+            return []
+        sources = self.source_ids(common >> 32)
+        return list(zip(sources, (common & 0xFFFFFFFF).tolist()))
+
+    def stats(self) -> dict:
+        manifest, segments = self._ensure_loaded()
+        return {
+            "sources": len(manifest["sources"]),
+            "chunks": len(manifest["chunks"]),
+            "rows": int(sum(len(seg) for seg in segments)),
+        }
+
+
+# Example usage (for testing)
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query the detection archive")
+    parser.add_argument("--root", default=ARCHIVE_DIR)
+    parser.add_argument("--species", nargs="*", help="species names to filter on")
+    parser.add_argument("--together", action="store_true", help="list frames where all species co-occur")
+    parser.add_argument("--min-danger", type=float)
+    parser.add_argument("--days", type=float, help="only detections from the last N days")
+    parser.add_argument("--compact", action="store_true")
+    args = parser.parse_args()
+
+    store = DetectionStore(args.root)
+    if args.compact:
+        store.compact()
+
+    start = time.perf_counter()
+    if args.together and args.species:
+        hits = store.frames_with(args.species)
+        elapsed = time.perf_counter() - start
+        print(f"=== Frames with {' + '.join(args.species)}: {len(hits)} ===")
+        for source_id, frame in hits[:20]:
+            print(f"{source_id[:12]}  frame {frame}")
+    else:
+        since = time.time() - args.days * 86400 if args.days else None
+        rows = store.query(species=args.species, since=since, min_danger=args.min_danger)
+        elapsed = time.perf_counter() - start
+        print(f"=== Matching detections: {len(rows['class_id'])} ===")
+    print(f"⏱️ Query time: {elapsed * 1000:.2f} ms | {store.stats()}")
@@ -0,0 +1,150 @@
+# ================================================
+# frame_dedup.py
+# ================================================
+import cv2
+import numpy as np
+from collections import OrderedDict
+
+# Hash grid size: 8x8 -> 64-bit hash
+HASH_SIZE = 8
+
+# Max Hamming distance (out of 64 bits) for two frames to count as duplicates
+DEFAULT_THRESHOLD = 5
+
+# Number of recent frames kept in the LRU cache
+DEFAULT_CACHE_SIZE = 64
+
+
+def _to_gray(frame):
+    if frame.ndim == 3:
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return frame
+
+
+def average_hash(frame, hash_size: int = HASH_SIZE) -> int:
+    """Average hash: downscale to hash_size x hash_size, threshold on the mean."""
+    small = cv2.resize(_to_gray(frame), (hash_size, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small > small.mean()).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def difference_hash(frame, hash_size: int = HASH_SIZE) -> int:
+    """Difference hash: compare horizontally adjacent pixels of a downscaled frame."""
+    small = cv2.resize(_to_gray(frame), (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+HASH_FUNCTIONS = {
+    "dhash": difference_hash,
+    "ahash": average_hash,
+}
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class DetectionCache:
+    """
+    LRU cache of detector results keyed by perceptual hash.
+
+    A frame whose hash is within `threshold` bits of a cached frame (run with
+    the same detection params) reuses that frame's results instead of running
+    the detector again.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, threshold=DEFAULT_THRESHOLD, method="dhash"):
+        self.max_size = max_size
+        self.threshold = threshold
+        self.hash_fn = HASH_FUNCTIONS[method]
+        self._entries = OrderedDict()  # frame_hash -> (params, results, n_detections)
+        self.hits = 0
+        self.misses = 0
+        self.detections_saved = 0
+
+    def lookup(self, frame_hash: int, params=()):
+        """Return cached results for the closest near-identical frame, or None."""
+        best_key, best_distance = None, self.threshold + 1
+        # Newest first, so ties go to the most recently used frame
+        for key in reversed(self._entries):
+            entry_params = self._entries[key][0]
+            if entry_params != params:
+                continue
+            distance = hamming_distance(key, frame_hash)
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        if best_key is None:
+            self.misses += 1
+            return None
+        _, results, n_detections = self._entries[best_key]
+        self._entries.move_to_end(best_key)
+        self.hits += 1
+        self.detections_saved += n_detections
+        return results
+
+    def store(self, frame_hash: int, results, n_detections: int, params=()):
+        self._entries[frame_hash] = (params, results, n_detections)
+        self._entries.move_to_end(frame_hash)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def predict(self, frame, predict_fn, params=()):
+        """
+        Run predict_fn(frame) unless a near-identical frame is cached.
+        Returns (results, cache_hit).
+        """
+        # The hash ignores resolution, but cached boxes are in pixel coordinates
+        params = (frame.shape[:2],) + tuple(params)
+        frame_hash = self.hash_fn(frame)
+        results = self.lookup(frame_hash, params)
+        if results is not None:
+            return results, True
+        results = predict_fn(frame)
+        n_detections = len(results[0].boxes) if results else 0
+        self.store(frame_hash, results, n_detections, params)
+        return results, False
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hit_rate, 4),
+            "detections_saved": self.detections_saved,
+        }
+
+
+# Example usage (for testing)
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Usage: python frame_dedup.py <video_path> [threshold]")
+        sys.exit(1)
+
+    threshold = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_THRESHOLD
+    cache = DetectionCache(threshold=threshold)
+    cap = cv2.VideoCapture(sys.argv[1])
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        # Dry run: count how many frames would skip the detector
+        cache.predict(frame, lambda f: [])
+    cap.release()
+
+    print("=== Perceptual Hash Dedup (dry run) ===")
+    for k, v in cache.stats().items():
+        print(f"{k:18s} ➤ {v}")
@@ -0,0 +1,239 @@
+# ================================================
+# runtime_config.py
+# ================================================
+# Thread and core layout for inference. Call configure_environment() before
+# torch / cv2 are imported so their OpenMP pools start with the configured
+# size. numpy's BLAS pool is sized when numpy is first imported, which under
+# Streamlit happens before the app script runs; set the same variables in the
+# launch environment to cover it.
+import os
+import json
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+CONFIG_PATH = "runtime_config.json"
+BENCHMARK_DIR = "images"
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def default_config():
+    return {
+        "replicas": 1,
+        "threads_per_replica": len(available_cores()),
+        "opencv_threads": 1,
+    }
+
+
+def fit_to_cores(config):
+    """Clamp replicas x threads to the cores this process may use."""
+    n_cores = len(available_cores())
+    threads = max(1, min(config["threads_per_replica"], n_cores))
+    replicas = max(1, min(config["replicas"], n_cores // threads))
+    if (replicas, threads) != (config["replicas"], config["threads_per_replica"]):
+        print(f"⚠️ WARNING: {config['replicas']} replicas x {config['threads_per_replica']} threads "
+              f"does not fit {n_cores} available cores, using {replicas} x {threads}.")
+    return dict(config, replicas=replicas, threads_per_replica=threads)
+
+
+def load_config(path=CONFIG_PATH):
+    config = default_config()
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            config.update(json.load(f))
+    # A config copied from another machine or run under a CPU limit may ask for too much
+    return fit_to_cores(config)
+
+
+def save_config(config, path=CONFIG_PATH):
+    with open(path, "w") as f:
+        json.dump(config, f, indent=2)
+
+
+def configure_environment(config=None):
+    """Size the BLAS/OpenMP pools via env vars (only effective before import)."""
+    config = config or load_config()
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(config["threads_per_replica"])
+    return config
+
+
+def configure_threads(intra_op, inter_op=1, opencv_threads=1):
+    """Set torch intra/inter-op and OpenCV thread counts for this process."""
+    import cv2
+    import torch
+
+    torch.set_num_threads(intra_op)
+    try:
+        torch.set_num_interop_threads(inter_op)
+    except RuntimeError:
+        pass  # can only be set once, before any inter-op work has started
+    cv2.setNumThreads(opencv_threads)
+
+
+def core_sets(replicas, threads_per_replica):
+    """Split the available cores into disjoint sets, one per replica."""
+    cores = available_cores()
+    if replicas * threads_per_replica > len(cores):
+        raise ValueError(f"{replicas} x {threads_per_replica} threads exceeds {len(cores)} available cores")
+    return [cores[i * threads_per_replica:(i + 1) * threads_per_replica] for i in range(replicas)]
+
+
+# ======================================================
+# Multi-replica model pool
+# ======================================================
+class ModelPool:
+    """
+    N copies of the model, each served by one thread pinned to its own core
+    set. Calls go onto a shared queue and are picked up by whichever replica
+    is free, so the pool can stand in for a single YOLO model (`predict`,
+    `names`, `overrides`) from any number of sessions or job workers.
+    """
+
+    def __init__(self, model_path, config=None, warm=True):
+        self.config = fit_to_cores(config or load_config())
+        self.replicas = self.config["replicas"]
+        self.threads_per_replica = self.config["threads_per_replica"]
+        configure_threads(self.threads_per_replica, opencv_threads=self.config["opencv_threads"])
+
+        self._tasks = queue.Queue()
+        self._ready = threading.Barrier(self.replicas + 1)
+        self.names = None
+        self.overrides = {}
+        self._load_error = None
+        self._threads = []
+        for i, cores in enumerate(core_sets(self.replicas, self.threads_per_replica)):
+            t = threading.Thread(target=self._replica_loop, args=(model_path, cores, warm),
+                                 name=f"model-replica-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        try:
+            self._ready.wait()
+        except threading.BrokenBarrierError:
+            # A replica failed to load; surface its error rather than the barrier's
+            self.close()
+            raise self._load_error from None
+
+    def _replica_loop(self, model_path, cores, warm):
+        import torch
+        from ultralytics import YOLO
+        from adaptive_resolution import warmup
+
+        try:
+            if hasattr(os, "sched_setaffinity"):
+                os.sched_setaffinity(0, cores)  # pins this thread (and the OpenMP threads it spawns)
+            torch.set_num_threads(len(cores))
+            model = YOLO(model_path)
+            if warm:
+                warmup(model)
+            self.names = model.names
+            self.overrides = dict(model.overrides)
+        except Exception as e:
+            self._load_error = e
+            self._ready.abort()
+            return
+        try:
+            self._ready.wait()
+        except threading.BrokenBarrierError:
+            return  # another replica failed to load
+
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            fn, future = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(model))
+            except Exception as e:
+                future.set_exception(e)
+
+    def submit(self, fn):
+        """Run fn(model) on the next free replica; returns a Future."""
+        future = Future()
+        self._tasks.put((fn, future))
+        return future
+
+    def predict(self, *args, **kwargs):
+        return self.submit(lambda m: m.predict(*args, **kwargs)).result()
+
+    def close(self):
+        for _ in self._threads:
+            self._tasks.put(None)
+        for t in self._threads:
+            t.join()
+
+
+# ======================================================
+# Auto-tune: best replicas x threads split for this machine
+# ======================================================
+def candidate_configs(n_cores):
+    for replicas in range(1, n_cores + 1):
+        if n_cores % replicas == 0:
+            yield {"replicas": replicas, "threads_per_replica": n_cores // replicas, "opencv_threads": 1}
+
+
+def benchmark(model_path, frames, config, rounds=2):
+    """Images/sec with every frame submitted at once (saturated pool)."""
+    pool = ModelPool(model_path, config)
+    for frame in frames[:pool.replicas]:
+        pool.predict(frame, verbose=False)
+    start = time.perf_counter()
+    futures = [pool.submit(lambda m, f=f: m.predict(f, verbose=False)) for _ in range(rounds) for f in frames]
+    for future in futures:
+        future.result()
+    rate = len(futures) / (time.perf_counter() - start)
+    pool.close()
+    return rate
+
+
+def autotune(model_path, image_dir=BENCHMARK_DIR, path=CONFIG_PATH):
+    import cv2
+
+    files = [os.path.join(image_dir, f) for f in sorted(os.listdir(image_dir))
+             if f.lower().endswith((".jpg", ".jpeg", ".png"))]
+    frames = [img for img in (cv2.imread(f) for f in files) if img is not None]
+    if not frames:
+        raise SystemExit(f"No benchmark images found in {image_dir}/")
+
+    n_cores = len(available_cores())
+    print(f"🔧 Auto-tuning on {n_cores} cores with {len(frames)} images\n")
+    best, best_rate = None, 0.0
+    for config in candidate_configs(n_cores):
+        # The interop pool can only be sized once per process, so each
+        # candidate only varies replicas and intra-op threads
+        rate = benchmark(model_path, frames, config)
+        print(f"replicas={config['replicas']:2d} threads={config['threads_per_replica']:2d} ➤ {rate:7.2f} img/s")
+        if rate > best_rate:
+            best, best_rate = config, rate
+
+    save_config(best, path)
+    print(f"\n✅ Best: {best['replicas']} replicas x {best['threads_per_replica']} threads "
+          f"({best_rate:.2f} img/s) saved to {path}")
+    return best
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inference runtime configuration")
+    parser.add_argument("--autotune", action="store_true", help="benchmark replica/thread splits")
+    parser.add_argument("--model", default="animal_training_fast_final/yolov8n_fast_clean_mapped/weights/best.pt")
+    parser.add_argument("--images", default=BENCHMARK_DIR)
+    args = parser.parse_args()
+
+    if args.autotune:
+        # Keep the BLAS pools single-threaded; each replica sizes its own OpenMP pool
+        configure_environment({"threads_per_replica": 1})
+        autotune(args.model, args.images)
+    else:
+        print(json.dumps(load_config(), indent=2))
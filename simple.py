@@ -1,8 +1,15 @@
 # evaluate_model.py
 
+import runtime_config
+config = runtime_config.configure_environment()  # before torch sizes its thread pools
+
 from ultralytics import YOLO
 import torch
 
+# Single model here, so give it every core the replicas would share
+runtime_config.configure_threads(config["replicas"] * config["threads_per_replica"],
+                                 opencv_threads=config["opencv_threads"])
+
 # ==============================================================
 # 1️⃣ AUTO DEVICE DETECTION
 # ==============================================================
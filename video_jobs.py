@@ -0,0 +1,436 @@
+# ================================================
+# video_jobs.py
+# ================================================
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import threading
+import cv2
+import numpy as np
+
+from frame_dedup import DetectionCache
+from adaptive_resolution import ResolutionController, reference_size
+from cascade import CascadeDetector, FIRST_PASS_SIZE, FIRST_PASS_CONF
+from fuzzy_danger_level import compute_danger_level
+
+# Job state, progress and outputs are persisted here so a page reload can
+# pick a job back up by id
+JOBS_DIR = "video_jobs"
+
+# Job workers shared by every session; inference goes through the model pool
+MAX_WORKERS = 2
+
+# Admission limits: total jobs waiting, and active jobs per session
+MAX_QUEUED = 8
+MAX_JOBS_PER_OWNER = 2
+
+# Finished jobs and their outputs are deleted after this many seconds, or
+# sooner once more than MAX_FINISHED_JOBS have piled up
+JOB_TTL = 24 * 3600
+MAX_FINISHED_JOBS = 50
+
+# Minimum seconds between progress writes
+PROGRESS_INTERVAL = 0.5
+
+ACTIVE_STATES = ("queued", "running")
+
+# Job ids are uuid4 hex prefixes; anything else (e.g. from ?job=) is rejected
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{12}")
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+# ======================================================
+# Shared detection helpers (used by the app and the workers)
+# ======================================================
+def record_detections(writer, names, frame_idx, timestamp, results):
+    """Append one frame's detections (with fuzzy danger level) to the archive."""
+    if not results or len(results[0].boxes) == 0:
+        return
+    boxes = results[0].boxes
+    class_ids = boxes.cls.cpu().numpy().astype(int)
+    dangers = [compute_danger_level(names[c]) for c in class_ids]
+    writer.add(frame_idx, timestamp, class_ids, boxes.conf.cpu().numpy(), boxes.xyxy.cpu().numpy(), dangers)
+
+
+def archive_settings(settings):
+    """Detector settings that change what gets archived for a source."""
+    return {
+        "conf": settings["conf"],
+        "iou": settings["iou"],
+        "adaptive": bool(settings.get("adaptive")),
+        "cascade": bool(settings.get("cascade")),
+    }
+
+
+def archive_source_id(content_id, settings):
+    s = archive_settings(settings)
+    return f"{content_id}:c{s['conf']}:i{s['iou']}:a{int(s['adaptive'])}:k{int(s['cascade'])}"
+
+
+def find_archived(store, content_id, settings):
+    """
+    An archived run of this content that can be replayed under `settings`:
+    same IoU and modes, stored at or below the current confidence (replay
+    filters it up). Returns its source id, or None if inference must run.
+    """
+    wanted = archive_settings(settings)
+    best_id, best_conf = None, None
+    for source_id, meta in store.sources():
+        if meta.get("content") != content_id:
+            continue
+        if any(meta.get(k) != wanted[k] for k in ("iou", "adaptive", "cascade")):
+            continue
+        if meta["conf"] <= wanted["conf"] and (best_conf is None or meta["conf"] > best_conf):
+            best_id, best_conf = source_id, meta["conf"]
+    return best_id
+
+
+def filter_confidence(rows, conf):
+    keep = rows["confidence"] >= conf
+    return {name: col[keep] for name, col in rows.items()}
+
+
+def draw_detections(frame, rows, names):
+    """Redraw archived detections on a frame without running the detector."""
+    for cid, conf, box in zip(rows["class_id"], rows["confidence"], rows["box"]):
+        x1, y1, x2, y2 = map(int, box)
+        label = f"{names[int(cid)]} {conf:.2f}"
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        cv2.putText(frame, label, (x1, max(y1 - 6, 0)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+    return frame
+
+
+# ======================================================
+# Video pipeline (no Streamlit calls, safe to run in a worker)
+# ======================================================
+def annotate_video(model, video_path, output_path, settings, store, content_id,
+                   on_progress=None, cancel_event=None, on_alert=None):
+    """
+    Detect animals in every frame and write the annotated clip to output_path.
+    Content already archived under compatible settings is replayed from the
+    stored detections.
+    Returns a summary dict, or None if cancelled.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+    fps = int(cap.get(cv2.CAP_PROP_FPS))
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    conf, iou = settings["conf"], settings["iou"]
+    cache = DetectionCache(threshold=settings["dedup_threshold"])
+    controller = None
+    if settings.get("adaptive"):
+        controller = ResolutionController(mode="video", fixed_size=reference_size(model))
+    if controller is not None:
+        sized_predict = lambda f, size: model.predict(f, imgsz=size, conf=conf, iou=iou, verbose=False)
+        predict_fn = lambda f: controller.predict(f, sized_predict)
+    else:
+        predict_fn = lambda f: model.predict(f, conf=conf, iou=iou, verbose=False)
+    cascade = None
+    if settings.get("cascade"):
+        first_pass_fn = lambda f: model.predict(f, imgsz=FIRST_PASS_SIZE, conf=min(FIRST_PASS_CONF, conf),
+                                                iou=iou, verbose=False)
+        cascade = CascadeDetector(first_pass_fn, predict_fn, model.names, on_alert=on_alert)
+    detected_species = set()
+
+    replay_id = find_archived(store, content_id, settings)
+    archived = replay_id is not None
+    if archived:
+        rows = filter_confidence(store.get_source(replay_id), conf)
+    else:
+        meta = {"type": "video", "content": content_id, "fps": fps, **archive_settings(settings)}
+        writer = store.writer(archive_source_id(content_id, settings), meta=meta)
+        start_time = time.time()
+
+    frame_idx = 0
+    cancelled = False
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            cancelled = True
+            break
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        if archived:
+            lo, hi = np.searchsorted(rows["frame"], [frame_idx, frame_idx + 1])
+            frame_rows = {name: col[lo:hi] for name, col in rows.items()}
+            annotated_frame = draw_detections(frame, frame_rows, model.names)
+            detected_species.update(model.names[int(c)] for c in frame_rows["class_id"])
+            if cascade is not None:
+                cascade.check_alerts(frame_rows["class_id"].tolist(), frame_rows["confidence"].tolist(), frame_idx)
+        else:
+            reused = False
+            frame_predict = predict_fn
+            if cascade is not None:
+                frame_predict = lambda f, i=frame_idx: cascade.predict(f, i)
+            if cascade is not None and not cascade.needs_inference(frame_idx):
+                # Between first passes: not computed on this frame, so never cached or archived
+                results, reused = cascade.reuse(), True
+            elif settings["dedup_enabled"]:
+                results, hit = cache.predict(frame, frame_predict, params=(conf, iou))
+                if hit and cascade is not None:
+                    cascade.observe(results, frame_idx)
+            else:
+                results = frame_predict(frame)
+            # Results may be reused from an earlier frame, so draw on this one
+            annotated_frame = results[0].plot(img=frame)
+            if not reused:
+                record_detections(writer, model.names, frame_idx, start_time + frame_idx / max(fps, 1), results)
+
+            if results and len(results[0].boxes) > 0:
+                for c in results[0].boxes.cls:
+                    detected_species.add(model.names[int(c)])
+
+        out.write(annotated_frame)
+        frame_idx += 1
+        if on_progress is not None:
+            on_progress(frame_idx, frame_count)
+
+    cap.release()
+    out.release()
+    if cancelled:
+        return None
+    if not archived:
+        writer.commit()
+
+    return {
+        "frames": frame_idx,
+        "species": sorted(detected_species),
+        "archived": archived,
+        "dedup": cache.stats() if settings["dedup_enabled"] and not archived else None,
+        "resolution": controller.stats() if controller is not None and not archived else None,
+        "cascade": cascade.stats() if cascade is not None else None,
+    }
+
+
+# ======================================================
+# Job manager
+# ======================================================
+class JobManager:
+    """
+    Bounded worker pool for video jobs, shared across Streamlit sessions.
+
+    Jobs are admitted into a FIFO queue (rejected with QueueFullError past the
+    limits), picked up by a fixed set of worker threads that share one model
+    (typically a runtime_config.ModelPool), and their state is written to
+    JOBS_DIR/<job_id>.json so the UI can poll it and fetch results again
+    after a reload. submit() takes ownership of the input video file: it is
+    deleted once the job ends or if the job is not admitted. Finished jobs
+    are kept for job_ttl seconds, at most max_finished_jobs of them.
+    """
+
+    def __init__(self, model, store, jobs_dir=JOBS_DIR, max_workers=MAX_WORKERS,
+                 max_queued=MAX_QUEUED, max_jobs_per_owner=MAX_JOBS_PER_OWNER,
+                 job_ttl=JOB_TTL, max_finished_jobs=MAX_FINISHED_JOBS):
+        self.model = model
+        self.store = store
+        self.jobs_dir = jobs_dir
+        self.max_queued = max_queued
+        self.max_jobs_per_owner = max_jobs_per_owner
+        self.job_ttl = job_ttl
+        self.max_finished_jobs = max_finished_jobs
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._cancel_events = {}
+        os.makedirs(jobs_dir, exist_ok=True)
+        self._mark_interrupted()
+        with self._lock:
+            self._prune()
+
+        self._workers = []
+        for i in range(max_workers):
+            t = threading.Thread(target=self._worker_loop, name=f"video-worker-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    # ---------------- persistence ----------------
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        tmp = self._job_path(job["id"]) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(job, f, indent=2)
+        os.replace(tmp, self._job_path(job["id"]))
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            self._save(job)
+
+    def _mark_interrupted(self):
+        """Jobs left active by a previous server process can never finish."""
+        for name in os.listdir(self.jobs_dir):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(self.jobs_dir, name), "r") as f:
+                job = json.load(f)
+            if job.get("state") in ACTIVE_STATES:
+                job.update(state="failed", error="Interrupted by server restart")
+                self._save(job)
+
+    def _prune(self):
+        """Delete finished jobs past job_ttl or beyond the newest max_finished_jobs (caller holds the lock)."""
+        finished = []
+        for name in os.listdir(self.jobs_dir):
+            job_id = name[:-len(".json")]
+            if not name.endswith(".json") or not JOB_ID_PATTERN.fullmatch(job_id):
+                continue
+            job = self._jobs.get(job_id)
+            if job is None:
+                try:
+                    with open(os.path.join(self.jobs_dir, name), "r") as f:
+                        job = json.load(f)
+                except (OSError, ValueError):
+                    continue
+            if job.get("state") in ACTIVE_STATES:
+                continue
+            finished.append((job.get("finished_at") or job.get("created_at", 0), job_id))
+
+        finished.sort(reverse=True)
+        cutoff = time.time() - self.job_ttl
+        for i, (ended_at, job_id) in enumerate(finished):
+            if i < self.max_finished_jobs and ended_at >= cutoff:
+                continue
+            for path in (self._job_path(job_id), os.path.join(self.jobs_dir, f"{job_id}.mp4")):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._jobs.pop(job_id, None)
+            self._cancel_events.pop(job_id, None)
+
+    # ---------------- public API ----------------
+    def _discard_input(self, video_path):
+        if os.path.exists(video_path):
+            os.remove(video_path)
+
+    def submit(self, video_path, content_id, settings, owner=None):
+        source_id = archive_source_id(content_id, settings)
+        with self._lock:
+            self._prune()
+            # Same clip under the same settings: share the job that is already on it
+            for job in self._jobs.values():
+                if job["state"] in ACTIVE_STATES and archive_source_id(job["content_id"], job["settings"]) == source_id:
+                    self._discard_input(video_path)
+                    return job["id"]
+            if owner is not None:
+                active = sum(1 for j in self._jobs.values() if j["owner"] == owner and j["state"] in ACTIVE_STATES)
+                if active >= self.max_jobs_per_owner:
+                    self._discard_input(video_path)
+                    raise QueueFullError(f"At most {self.max_jobs_per_owner} active video jobs per session.")
+            if sum(1 for j in self._jobs.values() if j["state"] == "queued") >= self.max_queued:
+                self._discard_input(video_path)
+                raise QueueFullError("Video queue is full, please try again shortly.")
+
+            job_id = uuid.uuid4().hex[:12]
+            job = {
+                "id": job_id,
+                "owner": owner,
+                "content_id": content_id,
+                "video_path": video_path,
+                "output_path": os.path.join(self.jobs_dir, f"{job_id}.mp4"),
+                "settings": settings,
+                "state": "queued",
+                "progress": 0.0,
+                "created_at": time.time(),
+                "result": None,
+                "alerts": [],
+                "error": None,
+            }
+            self._jobs[job_id] = job
+            self._cancel_events[job_id] = threading.Event()
+            self._save(job)
+            self._queue.put(job_id)
+            return job_id
+
+    def status(self, job_id):
+        if not JOB_ID_PATTERN.fullmatch(str(job_id)):
+            return None
+        with self._lock:
+            if job_id in self._jobs:
+                return dict(self._jobs[job_id])
+        path = self._job_path(job_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job["state"] == "queued":
+                # Frees its queue slot and owner quota now; the worker skips it
+                job.update(state="cancelled", finished_at=time.time())
+                self._save(job)
+                self._discard_input(job["video_path"])
+            event = self._cancel_events.get(job_id)
+        if event is not None:
+            event.set()
+
+    def queue_position(self, job_id):
+        with self._lock:
+            queued = sorted((j["created_at"], j["id"]) for j in self._jobs.values() if j["state"] == "queued")
+        ids = [jid for _, jid in queued]
+        return ids.index(job_id) + 1 if job_id in ids else 0
+
+    # ---------------- workers ----------------
+    def _worker_loop(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                with self._lock:
+                    job = self._jobs.get(job_id)
+                    # Cancelled (or pruned) while queued
+                    if job is None or job["state"] != "queued":
+                        continue
+                    job.update(state="running", started_at=time.time())
+                    self._save(job)
+                try:
+                    self._run(self.model, job_id)
+                finally:
+                    self._discard_input(job["video_path"])
+            finally:
+                self._queue.task_done()
+
+    def _run(self, model, job_id):
+        cancel_event = self._cancel_events[job_id]
+        job = self.status(job_id)
+
+        last_write = [0.0]
+
+        def on_progress(done, total):
+            now = time.time()
+            if now - last_write[0] >= PROGRESS_INTERVAL:
+                last_write[0] = now
+                self._update(job_id, progress=min(done / total, 1.0) if total else 0.0)
+
+        def on_alert(alert):
+            # Written straight away (not throttled) so the UI can show it on its next poll
+            with self._lock:
+                self._jobs[job_id]["alerts"].append(alert)
+                self._save(self._jobs[job_id])
+
+        try:
+            result = annotate_video(model, job["video_path"], job["output_path"], job["settings"],
+                                    self.store, job["content_id"], on_progress, cancel_event, on_alert)
+        except Exception as e:
+            self._update(job_id, state="failed", error=str(e), finished_at=time.time())
+            return
+
+        if result is None:
+            if os.path.exists(job["output_path"]):
+                os.remove(job["output_path"])
+            self._update(job_id, state="cancelled", finished_at=time.time())
+        else:
+            self._update(job_id, state="done", progress=1.0, result=result, finished_at=time.time())